@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import pickle
+from configparser import ConfigParser
+from pathlib import Path
+from sys import argv
+
+BASE_DIR = Path(__file__).parent
+ADDR_DIR = BASE_DIR / 'addresses'
+MODS_DIR = BASE_DIR / 'mods'
+CACHE_PATH = BASE_DIR / '.addrdb.pickle'
+
+_db = None
+
+
+def ini_files():
+    return sorted(ADDR_DIR.glob('*.ini')) + sorted(MODS_DIR.glob('*.ini'))
+
+
+def read_ini(path, base):
+    parser = ConfigParser()
+    parser.read(path)
+    return {
+        name: {k: int(v, base) for k, v in parser[name].items()}
+        for name in parser.sections()
+    }
+
+
+def build():
+    db = {}
+    for path in sorted(ADDR_DIR.glob('*.ini')):
+        mods_path = MODS_DIR / path.name
+        db[path.stem] = {
+            'addresses': read_ini(path, 16),
+            'mods': read_ini(mods_path, 10) if mods_path.exists() else {},
+        }
+    return db
+
+
+def load():
+    global _db
+    mtimes = {str(p): p.stat().st_mtime_ns for p in ini_files()}
+
+    if _db is not None and _db['mtimes'] == mtimes:
+        return _db['db']
+
+    try:
+        cached = pickle.loads(CACHE_PATH.read_bytes())
+        if cached['mtimes'] == mtimes:
+            _db = cached
+            return _db['db']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+
+    _db = {'mtimes': mtimes, 'db': build()}
+    try:
+        CACHE_PATH.write_bytes(pickle.dumps(_db))
+    except OSError:
+        pass
+    return _db['db']
+
+
+def get(version):
+    return load().get(version)
+
+
+if __name__ == '__main__':
+    for version, entry in load().items():
+        if len(argv) > 1 and version not in argv[1:]:
+            continue
+        print(f'{version}:')
+        for kind, sections in entry.items():
+            for section, values in sections.items():
+                print(f'  {kind}.{section}:', values)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import random
+import sys
+from pathlib import Path
+from sys import argv
+from time import perf_counter
+
+import hexdump
+import uvk5
+from uvk5 import (
+    DATA_DIR, Firmware, crc16, decrypt, encrypt, eprint, search_for_version,
+    xor_fw,
+)
+
+MIN_TIME = 0.2
+ROUNDS = 3
+SYNTHETIC_SIZE = 1 << 20
+
+STOCK = DATA_DIR / '2.01.26.bin'
+STOCK_RAW = DATA_DIR / '2.01.26_raw.bin'
+FLASHABLE = DATA_DIR / 'k5_v3.00.10_flashable.bin'
+
+
+def measure(fn, size):
+    best = None
+    for _ in range(ROUNDS):
+        n = 0
+        started = perf_counter()
+        while True:
+            fn()
+            n += 1
+            elapsed = perf_counter() - started
+            if elapsed >= MIN_TIME:
+                break
+        per_op = elapsed / n
+        best = per_op if best is None else min(best, per_op)
+    return {'ops': 1 / best, 'mbs': size / best / 1e6, 'seconds': best}
+
+
+def synthetic_pair(size, seed=0):
+    rnd = random.Random(seed)
+    a = bytearray(rnd.randbytes(size))
+    b = bytearray(a)
+    for _ in range(size // 4096):
+        i = rnd.randrange(size - 16)
+        n = rnd.randint(1, 16)
+        b[i:i+n] = rnd.randbytes(1) * n
+    return bytes(a), bytes(b)
+
+
+def hexdump_to_null(path):
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as null:
+        sys.stdout = null
+        try:
+            hexdump.main(path)
+        finally:
+            sys.stdout = stdout
+
+
+def uncached_version(data):
+    uvk5._version_cache.clear()
+    return search_for_version(data)
+
+
+def firmware_cases():
+    stock = STOCK.read_bytes()
+    raw = STOCK_RAW.read_bytes()
+    flashable = FLASHABLE.read_bytes()
+    big, big_mod = synthetic_pair(SYNTHETIC_SIZE)
+    big_enc = encrypt(big)
+    fw_a = Firmware.load(STOCK)
+    fw_b = Firmware.load(FLASHABLE)
+    big_a, big_b = Firmware(big, 'synthetic'), Firmware(big_mod, 'synthetic')
+    patterns = ('2.01', '5D E0 ?? ??', '00 20 ?? 00', 'UV-K5')
+
+    return {
+        'xor_fw': (lambda: xor_fw(stock), len(stock)),
+        'xor_fw/synthetic': (lambda: xor_fw(big), len(big)),
+        'crc16': (lambda: crc16(stock), len(stock)),
+        'crc16/synthetic': (lambda: crc16(big), len(big)),
+        'decrypt': (lambda: decrypt(stock), len(stock)),
+        'decrypt/flashable': (lambda: decrypt(flashable), len(flashable)),
+        'decrypt/synthetic': (lambda: decrypt(big_enc), len(big_enc)),
+        'encrypt': (lambda: encrypt(raw), len(raw)),
+        'encrypt/synthetic': (lambda: encrypt(big), len(big)),
+        'load': (lambda: Firmware.load(STOCK), len(stock)),
+        'compare': (lambda: fw_a.compare(fw_b), len(fw_a)),
+        'compare/synthetic': (lambda: big_a.compare(big_b), len(big_a)),
+        'search': (lambda: fw_a.search(*patterns), len(fw_a)),
+        'search/synthetic': (lambda: big_a.search(*patterns), len(big_a)),
+        'search_for_version': (lambda: uncached_version(raw), len(raw)),
+        'hexdump': (lambda: hexdump_to_null(STOCK), len(stock)),
+    }
+
+
+def protocol_cases(emu, radio):
+    radio.get_version()
+    return {
+        'proto/version': (radio.get_version, 16),
+        'proto/read_range': (lambda: radio.read_range(0, uvk5.UVK5.EEPROM_SIZE), uvk5.UVK5.EEPROM_SIZE),
+        'proto/channels': (radio.channels, 2 * 16 * 200),
+        'proto/write_mem': (lambda: radio.write_mem(0x100, bytes(0x80)), 0x80),
+    }
+
+
+def run(selected=None, protocol=True):
+    results = {}
+
+    def bench(cases):
+        for name, (fn, size) in cases.items():
+            if selected and not any(s in name for s in selected):
+                continue
+            results[name] = measure(fn, size)
+            r = results[name]
+            print(f'{name:<24} {r["ops"]:>12.1f} ops/s {r["mbs"]:>10.2f} MB/s')
+
+    bench(firmware_cases())
+
+    if protocol:
+        from emulator import Emulator
+        with Emulator(eeprom=os.urandom(uvk5.UVK5.EEPROM_SIZE), baud=0) as emu:
+            with uvk5.UVK5(emu.port) as radio:
+                bench(protocol_cases(emu, radio))
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    failed = []
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        slowdown = r['seconds'] / baseline[name]['seconds']
+        if slowdown > threshold:
+            failed.append(name)
+            eprint(f'SLOWER {name}: x{slowdown:.2f} (threshold x{threshold})')
+    return failed
+
+
+if __name__ == '__main__':
+    opts = dict(a[2:].partition('=')[::2] for a in argv[1:] if a.startswith('--'))
+    selected = [a for a in argv[1:] if not a.startswith('--')]
+
+    results = run(selected, 'no-protocol' not in opts)
+
+    if opts.get('save'):
+        Path(opts['save']).write_text(json.dumps(results, indent=2))
+
+    if opts.get('baseline'):
+        baseline = json.loads(Path(opts['baseline']).read_text())
+        if compare(results, baseline, float(opts.get('threshold') or 1.25)):
+            exit(1)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import json
+import re
+from pathlib import Path
+from sys import argv
+from time import time
+
+CACHE_DIR = Path.home() / '.cache' / 'uvk5'
+
+
+class EepromCache:
+    def __init__(self, port, version, size=0x2000, block_size=0x80, cache_dir=CACHE_DIR) -> None:
+        key = re.sub(r'[^0-9A-Za-z.]+', '_', f'{port}_{version}').strip('_')
+        self.size = size
+        self.block_size = block_size
+        self.data_path = Path(cache_dir) / f'{key}.bin'
+        self.meta_path = Path(cache_dir) / f'{key}.json'
+        self.data = bytearray(size)
+        self.stamps = [None] * (size // block_size)
+        self.load()
+
+    def load(self):
+        try:
+            data = self.data_path.read_bytes()
+            stamps = json.loads(self.meta_path.read_text())
+        except (OSError, ValueError):
+            return
+        if len(data) == self.size and len(stamps) == len(self.stamps):
+            self.data[:] = data
+            self.stamps = stamps
+
+    def save(self):
+        self.data_path.parent.mkdir(parents=True, exist_ok=True)
+        self.data_path.write_bytes(self.data)
+        self.meta_path.write_text(json.dumps(self.stamps))
+
+    def covers(self, offset, size):
+        return 0 <= offset and offset + size <= self.size
+
+    def blocks(self, offset, size):
+        return range(offset // self.block_size, (offset + size - 1) // self.block_size + 1)
+
+    def missing(self, ranges, max_age=None):
+        now = time()
+        need = []
+        for offset, size in ranges:
+            for b in self.blocks(offset, size):
+                stamp = self.stamps[b]
+                if stamp is None or (max_age is not None and now - stamp > max_age):
+                    need.append((b * self.block_size, self.block_size))
+        return need
+
+    def get(self, offset, size):
+        return bytes(self.data[offset:offset+size])
+
+    def put(self, offset, data):
+        end = min(offset + len(data), self.size)
+        self.data[offset:end] = data[:end-offset]
+        now = time()
+        for b in self.blocks(offset, end - offset):
+            # only fully covered blocks become fresh
+            if offset <= b * self.block_size and (b + 1) * self.block_size <= end:
+                self.stamps[b] = now
+
+    def invalidate(self, offset=0, size=None):
+        size = self.size - offset if size is None else size
+        for b in self.blocks(offset, size):
+            self.stamps[b] = None
+
+
+if __name__ == '__main__':
+    for meta in sorted(CACHE_DIR.glob('*.json')):
+        stamps = json.loads(meta.read_text())
+        fresh = [s for s in stamps if s is not None]
+        age = f'{time() - min(fresh):.0f}s' if fresh else '-'
+        if len(argv) > 1 and meta.stem not in argv[1:]:
+            continue
+        print(f'{meta.stem}: {len(fresh)}/{len(stamps)} blocks, oldest {age}')
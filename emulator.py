@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import tty
+from sys import argv
+from time import sleep
+
+from uvk5 import (
+    UVK5, KEY_COMM, NO_CRC, FrameCodec, FrameDecoder, b2i, eprint,
+    parse_payload, xor_key,
+)
+
+
+class Emulator:
+    """Software UV-K5 behind a pseudo-terminal, serves version and EEPROM"""
+
+    def __init__(self, version='2.01.26', eeprom=None, baud=38400, latency=0.0,
+                 drop=0.0, corrupt=0.0, garbage=0.0, max_block=0x80,
+                 stock_crc=False, bootloader=None, seed=None) -> None:
+        self.version = version
+        self.eeprom = bytearray(eeprom if eeprom is not None else bytes(UVK5.EEPROM_SIZE))
+        self.patch = bytearray(0x10000)
+        self.flash = bytearray(0x10000)
+        self.flash_version = None
+        self.baud = baud
+        self.latency = latency
+        self.drop = drop
+        self.corrupt = corrupt
+        self.garbage = garbage
+        self.max_block = max_block
+        self.stock_crc = stock_crc
+        self.bootloader = bootloader
+        self.random = random.Random(seed)
+        self.codec = FrameCodec()
+        # beacon and serve threads share the codec buffer and the line
+        self.lock = threading.Lock()
+        self.decoder = FrameDecoder()
+        self.requests = {}
+        self.master = None
+        self.slave = None
+        self.threads = []
+        self.port = None
+        self.running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.threads = [threading.Thread(target=self._serve, daemon=True)]
+        if self.bootloader:
+            self.threads.append(threading.Thread(target=self._beacon, daemon=True))
+        for t in self.threads:
+            t.start()
+        return self.port
+
+    def stop(self):
+        # fds are reused by the next pty, nothing may write to them once closed
+        self.running = False
+        for t in self.threads:
+            t.join()
+        for fd in (self.slave, self.master):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _serve(self):
+        while self.running:
+            try:
+                if not select.select([self.master], [], [], 0.05)[0]:
+                    continue
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            if self.baud:
+                sleep(len(data) * 10 / self.baud)
+            self.decoder.feed(data)
+            while (payload := self.decoder.pop()) is not None:
+                self._handle(*parse_payload(payload))
+
+    def _beacon(self):
+        while self.running:
+            self.send(UVK5.CMD_FLASH_BEACON, bytes(16) + self.bootloader.encode().ljust(16, b'\x00'))
+            sleep(0.2)
+
+    def send(self, cmd_id, data):
+        with self.lock:
+            self._send(cmd_id, data)
+
+    def _send(self, cmd_id, data):
+        if self.random.random() < self.drop:
+            return
+
+        frame = bytearray(self.codec.encode(cmd_id, data))
+        payload_len = len(frame) - 8
+        if self.stock_crc:
+            frame[-4:-2] = xor_key(NO_CRC, KEY_COMM, payload_len)
+        if self.random.random() < self.corrupt:
+            frame[4 + self.random.randrange(payload_len + 2)] ^= 0xFF
+        if self.random.random() < self.garbage:
+            frame[:0] = bytes(self.random.randrange(256) for _ in range(self.random.randint(1, 8)))
+
+        sleep(self.latency + (len(frame) * 10 / self.baud if self.baud else 0))
+        if not self.running:
+            return
+        try:
+            os.write(self.master, frame)
+        except OSError:
+            pass
+
+    def _handle(self, cmd_id, data):
+        self.requests[cmd_id] = self.requests.get(cmd_id, 0) + 1
+
+        if cmd_id == UVK5.CMD_VERSION_REQ and not self.bootloader:
+            self.send(UVK5.CMD_VERSION_RES, self.version.encode().ljust(16, b'\x00'))
+
+        elif cmd_id == UVK5.CMD_SETTINGS_REQ and not self.bootloader:
+            offset, size = b2i(data[:4]), b2i(data[4:6])
+            if size > self.max_block:
+                return
+            header = struct.pack('<HBB', offset & 0xFFFF, size & 0xFF, 0)
+            self.send(UVK5.CMD_SETTINGS_RES, header + bytes(self.eeprom[offset:offset+size]))
+
+        elif cmd_id in (UVK5.CMD_SETTINGS_WRITE_REQ, UVK5.CMD_PATCH_WRITE) and not self.bootloader:
+            offset, size = struct.unpack('<HH', data[:4])
+            if size > self.max_block:
+                return
+            target = self.eeprom if cmd_id == UVK5.CMD_SETTINGS_WRITE_REQ else self.patch
+            target[offset:offset+size] = data[8:8+size]
+            self.send(cmd_id + 1, data[:4])
+
+        elif cmd_id == UVK5.CMD_FLASH_VERSION and self.bootloader:
+            self.flash_version = data[:16].decode(errors='ignore').rstrip('\x00')
+
+        elif cmd_id == UVK5.CMD_FLASH_WRITE_REQ and self.bootloader:
+            offset, size = int.from_bytes(data[4:6], 'big'), b2i(data[8:10])
+            self.flash[offset:offset+size] = data[12:12+size]
+            self.send(UVK5.CMD_FLASH_WRITE_RES, data[:6] + b'\x00\x00')
+
+
+if __name__ == '__main__':
+    opts = dict(a[2:].partition('=')[::2] for a in argv[1:] if a.startswith('--'))
+    types = {'version': str, 'bootloader': str, 'baud': int, 'max_block': lambda v: int(v, 0), 'seed': int}
+
+    kwargs = {}
+    for k, v in opts.items():
+        k = k.replace('-', '_')
+        if k == 'eeprom':
+            kwargs[k] = open(v, 'rb').read()
+        elif k == 'stock_crc':
+            kwargs[k] = True
+        else:
+            kwargs[k] = types.get(k, float)(v)
+
+    with Emulator(**kwargs) as emu:
+        eprint('Emulated UV-K5 at', emu.port)
+        try:
+            while True:
+                sleep(1)
+        except KeyboardInterrupt:
+            pass
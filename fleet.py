@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import json
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from pathlib import Path
+from sys import argv
+from time import time
+
+from uvk5 import UVK5, Firmware, eprint
+
+Result = namedtuple('Result', 'port ok result error seconds')
+
+
+def expand_ports(spec):
+    ports = []
+    for part in spec.split(','):
+        if any(c in part for c in '*?['):
+            ports += sorted(glob(part))
+        elif part:
+            ports.append(part)
+    return ports
+
+
+def safe_name(port):
+    return re.sub(r'[^0-9A-Za-z.]+', '_', port).strip('_')
+
+
+def op_version(radio):
+    return radio.version
+
+
+def op_channels(radio):
+    return radio.channels()
+
+
+def op_dump(radio, out_dir='.'):
+    path = Path(out_dir) / f'{safe_name(radio.port)}_{radio.version}.bin'
+    radio.dump_eeprom(path)
+    return str(path)
+
+
+def op_write(radio, image, base=None):
+    return radio.write_eeprom(image, base)
+
+
+def op_flash(radio, fw_path, mods=''):
+    fw = Firmware.load(fw_path)
+    if mods:
+        fw.apply_mods(mods.split(','))
+    radio.send_firmware(fw)
+    return fw.version
+
+
+OPS = {
+    'version': op_version,
+    'channels': op_channels,
+    'dump': op_dump,
+    'write': op_write,
+    'flash': op_flash,
+}
+
+
+def run_one(port, op, args):
+    started = time()
+    try:
+        with UVK5(port) as radio:
+            if op != 'flash':  # radio in bootloader mode does not answer version
+                radio.get_version()
+            res = OPS[op](radio, *args)
+        return Result(port, True, res, None, time() - started)
+    except (Exception, SystemExit) as e:
+        return Result(port, False, None, repr(e), time() - started)
+
+
+def run(ports, op, args=(), workers=None):
+    with ThreadPoolExecutor(max_workers=workers or len(ports) or 1) as pool:
+        return list(pool.map(lambda p: run_one(p, op, args), ports))
+
+
+def report(results):
+    for r in results:
+        status = 'OK' if r.ok else 'FAIL'
+        print(f'{r.port}: {status} ({r.seconds:.2f}s)', r.result if r.ok else r.error)
+    failed = sum(not r.ok for r in results)
+    print(f'{len(results) - failed}/{len(results)} OK')
+
+
+if __name__ == '__main__':
+    if len(argv) < 3 or argv[2] not in OPS:
+        eprint(f'Usage: {argv[0]} <ports|glob>[,...] <op:({"|".join(OPS)})> [args] [--json]')
+        exit(255)
+
+    args = [a for a in argv[3:] if a != '--json']
+    ports = expand_ports(argv[1])
+    if not ports:
+        eprint(f'No ports matched {argv[1]}')
+        exit(1)
+    results = run(ports, argv[2], args)
+
+    if '--json' in argv:
+        print(json.dumps([r._asdict() for r in results], indent=2))
+    else:
+        report(results)
+
+    exit(0 if all(r.ok for r in results) else 1)
@@ -1,10 +1,33 @@
 #!/usr/bin/env python3
 
-from uvk5 import UVK5, argv, eprint, Firmware
+import os
+from pathlib import Path
+
+from uvk5 import UVK5, argv, eprint, Firmware, FirmwareMap, Scanner
+
+READ_ONLY_CMDS = ('cmp', 'search')
+
+def print_hits(hits, prefix=''):
+    for hit in hits:
+        print(f'{prefix}[{hit.offset}] {hit.pattern}: {hit.context}')
+
+
+def scan(patterns_file, paths):
+    lines = Path(patterns_file).read_text().splitlines()
+    patterns = [l.strip() for l in lines if l.strip() and not l.startswith('#')]
+    for path, hits in Scanner(patterns).scan_files(paths).items():
+        print_hits(hits, f'{path} ')
+
 
 def main(cmd):
     argc = len(argv)
-    fw = Firmware.load(argv[2])
+
+    if cmd == 'scan':
+        scan(argv[2], argv[3:])
+        return
+
+    load = FirmwareMap.load if cmd in READ_ONLY_CMDS else Firmware.load
+    fw = load(argv[2])
 
     eprint('Version:', fw.version)
 
@@ -19,13 +42,22 @@ def main(cmd):
         fw.apply_mods(argv[3].split(','))
         fw.write()
         if argc == 5:
+            eprint('Power on radio with PTT pressed to enter bootloader')
             with UVK5(argv[4]) as uvk5:
-                uvk5.get_version()
                 uvk5.send_firmware(fw)
 
     if cmd == 'cmp':
-        fw2 = Firmware.load(argv[3])
-        fw.compare(fw2)
+        fw2 = load(argv[3])
+        gap = int(argv[4]) if argc > 4 else 0
+        for ch in fw.compare(fw2, gap):
+            print('0x%x:' % ch.offset, ch.old.hex(), ch.new.hex())
+
+    if cmd == 'delta':
+        os.write(1, fw.make_delta(Firmware.load(argv[3])))
+
+    if cmd == 'apply':
+        fw.apply_delta(Path(argv[3]).read_bytes())
+        fw.write()
 
     if cmd == 'enc':
         fw.write()
@@ -34,7 +66,7 @@ def main(cmd):
         fw.write_raw()
 
     if cmd == 'search':
-        fw.search(argv[3].encode())
+        print_hits(fw.search(*argv[3:]))
 
 
 def usage():
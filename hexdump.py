@@ -1,23 +1,50 @@
 #!/usr/bin/env python3
 
-from functools import partial
+import sys
 from pathlib import Path
 from string import digits, ascii_letters, punctuation
 from sys import argv
 
 PRINTABLE = digits + ascii_letters + punctuation + " "
 
-def main(file):
-    pr = list(map(ord, PRINTABLE))
+ROW = 16
+CHUNK = ROW * 4096
+
+# non-printable bytes become latin-1 '·'
+TABLE = bytes(c if chr(c) in PRINTABLE else 0xB7 for c in range(256))
+
+
+def format_chunk(data, offset):
+    hexs = data.hex(' ').upper()
+    chars = data.translate(TABLE).decode('latin-1')
+    rows = []
+    for i in range(0, len(data), ROW):
+        row_hex = hexs[i*3:(i+ROW)*3-1]
+        rows.append(f'0x{offset+i:06x}  {row_hex}  {chars[i:i+ROW]}\n')
+    return ''.join(rows)
+
+
+def main(file, offset=0, length=None, out=None):
+    out = out or sys.stdout.buffer
+    sys.stdout.flush()
 
     with Path(file).open('rb') as f:
-        for i, block in enumerate(iter(partial(f.read, 16), b'')):
-            row = ['%02X'%c for c in block]
-            chars = [chr(c) if c in pr else '·' for c in block]
-            
-            print('0x%06x'%(i*16), end='  ')
-            print(*row, sep=' ', end='  ')
-            print(*chars, sep='')
-            
+        f.seek(offset)
+        left = length
+        while left is None or left > 0:
+            data = f.read(CHUNK if left is None else min(CHUNK, left))
+            if not data:
+                break
+            out.write(format_chunk(data, offset).encode())
+            offset += len(data)
+            if left is not None:
+                left -= len(data)
+
+    out.flush()
+
+
 if __name__ == "__main__":
-    main(argv[1])
+    opts = dict(a[2:].partition('=')[::2] for a in argv[1:] if a.startswith('--'))
+    args = [a for a in argv[1:] if not a.startswith('--')]
+    length = opts.get('length')
+    main(args[0], int(opts.get('offset') or '0', 0), int(length, 0) if length else None)
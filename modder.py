@@ -3,49 +3,53 @@
 import os
 from pathlib import Path
 from sys import argv
-from configparser import ConfigParser
 
-from uvk5 import decrypt, encrypt, eprint
+import addrdb
+from uvk5 import Firmware, encrypt_into, encrypted_size, eprint
 
-ADDR_DIR = Path(__file__).parent / 'addresses'
-MODS_DIR = Path(__file__).parent / 'mods'
-
-def main(encrypted_file_path):
-    file_bytes = Path(encrypted_file_path).read_bytes()
-    decrypted, version = decrypt(file_bytes)
+def modify(encrypted_file_path):
+    fw = Firmware.load(encrypted_file_path)
+    version = fw.version
     eprint('version:', version)
 
-    addr_file = ADDR_DIR / ('%s.ini' % version)
-    mods_file = MODS_DIR / ('%s.ini' % version)
-
-    addresses = ConfigParser()
-    mods = ConfigParser()
-    addresses.read(addr_file)
-    mods.read(mods_file)
+    entry = addrdb.get(version) or {'addresses': {}, 'mods': {}}
+    mods = entry['mods']
 
-
-    for section_name in addresses:
+    for section_name, section_values in entry['addresses'].items():
         eprint('[%s]' % section_name)
-        section_values = addresses[section_name]
-        for k in section_values:
-            addr = int(section_values.get(k), 16)
-            value = int.from_bytes(decrypted[addr:addr+4], 'little')
+        for k, addr in section_values.items():
+            value = int.from_bytes(fw[addr:addr+4], 'little')
             eprint(k, addr, value)
 
-            if mods[section_name] and mods[section_name].get(k):
-                new_value = mods[section_name].get(k)
+            new_value = mods.get(section_name, {}).get(k)
+            if new_value is not None:
                 eprint('new:', new_value)
-                decrypted = decrypted[:addr] + int(new_value).to_bytes(4, 'little') + decrypted[addr+4:]
+                fw.patch_single(addr, new_value)
 
-    encrypted = encrypt(decrypted, version)
+    encrypted = encrypt_into(bytearray(encrypted_size(len(fw))), fw, version)
 
-    if len(file_bytes) != len(encrypted):
+    if Path(encrypted_file_path).stat().st_size != len(encrypted):
         eprint('Something goes wrong. Check values or open issue.')
         exit(255)
 
-    os.write(1, encrypted)
+    return encrypted
+
+
+def output_path(path):
+    path = Path(path)
+    return path.with_name(f'{path.stem}_mod{path.suffix}')
+
+
+def main(paths):
+    if len(paths) == 1:
+        os.write(1, modify(paths[0]))
+        return
 
+    for path in paths:
+        out = output_path(path)
+        out.write_bytes(modify(path))
+        eprint('written:', out)
 
 
 if __name__ == "__main__":
-    main(argv[1])
+    main(argv[1:])
@@ -0,0 +1,249 @@
+import asyncio
+import os
+from time import monotonic, sleep
+
+import pytest
+
+from emulator import Emulator
+from uvk5 import DATA_DIR, UVK5, Firmware, FrameCodec, i2b16, i2b32, prepare_flash_frames
+from uvk5_async import AsyncUVK5
+
+EEPROM = os.urandom(UVK5.EEPROM_SIZE)
+
+
+@pytest.fixture
+def emu():
+    with Emulator(eeprom=EEPROM, baud=0, max_block=0xC0, seed=1) as emu:
+        yield emu
+
+
+@pytest.fixture
+def radio(emu):
+    s = UVK5(emu.port)
+    s.retry.backoff = 0
+    yield s
+    s.close()
+
+
+def test_version(radio):
+    assert radio.get_version() == '2.01.26'
+
+
+def test_probe_once(emu, radio):
+    assert radio.read_range(0, 0x400) == EEPROM[:0x400]
+    assert radio.block_size == 0xC0
+    assert radio.read_range(0x400, 0x400) == EEPROM[0x400:0x800]
+    assert emu.requests[UVK5.CMD_SETTINGS_REQ] == 2 + 2 * 6
+    assert not radio.stats.timeouts
+
+
+def test_cache_swapped_radio(emu, radio, tmp_path):
+    radio.use_cache(cache_dir=tmp_path)
+    radio.cache.put(0, bytes(UVK5.EEPROM_SIZE))  # left behind by another radio
+    assert radio.read_ranges([(0x100, 0x20), (0x1000, 0x100)]) == [EEPROM[0x100:0x120], EEPROM[0x1000:0x1100]]
+    assert radio.cache.get(0x1000, 0x100) == EEPROM[0x1000:0x1100]
+
+    count = emu.requests[UVK5.CMD_SETTINGS_REQ]
+    assert radio.read_ranges([(0x1000, 0x100)]) == [EEPROM[0x1000:0x1100]]
+    assert emu.requests[UVK5.CMD_SETTINGS_REQ] == count
+
+
+@pytest.mark.parametrize('window', [1, 4])
+def test_read_range_faults(window):
+    with Emulator(eeprom=EEPROM, baud=0, corrupt=0.1, drop=0.05, garbage=0.1, seed=2) as emu:
+        radio = UVK5(emu.port)
+        radio.retry.retries = 10
+        radio.retry.backoff = 0
+        radio.base_timeout = 0.2
+        radio.probed = True
+        assert radio.read_range(0, 0x800, window=window) == EEPROM[:0x800]
+        radio.close()
+
+
+def test_async_faults():
+    async def read(port):
+        async with AsyncUVK5(port, timeout=0.2) as radio:
+            radio.retry.retries = 10
+            radio.retry.backoff = 0
+            return await radio.read_range(0, 0x400)
+
+    with Emulator(eeprom=EEPROM, baud=0, corrupt=0.1, drop=0.05, seed=3) as emu:
+        assert asyncio.run(read(emu.port)) == EEPROM[:0x400]
+
+
+@pytest.mark.parametrize('window', [1, 4])
+def test_read_range_short_reply(radio, window):
+    # the emulator answers reads past the end with short blocks
+    with pytest.raises(ValueError, match='Bad read response'):
+        radio.read_range(UVK5.EEPROM_SIZE - 0x100, 0x200, block_size=0x80, window=window)
+
+
+def test_async_concurrent(emu):
+    async def read(port):
+        async with AsyncUVK5(port) as radio:
+            return await asyncio.gather(*(radio.read_mem(o, 0x10) for o in range(0, 0x800, 0x80)))
+
+    for o, (cmd_id, data) in zip(range(0, 0x800, 0x80), asyncio.run(read(emu.port))):
+        assert data[4:] == EEPROM[o:o+0x10]
+
+
+def test_upload(emu, radio):
+    data = os.urandom(0x300)
+    assert radio.upload(UVK5.CMD_PATCH_WRITE, b'') == UVK5.UPLOAD_CHUNK_SIZES[0]
+    assert radio.upload(UVK5.CMD_PATCH_WRITE, data) == UVK5.UPLOAD_CHUNK_SIZES[0]
+    assert emu.patch[:len(data)] == data
+
+
+
+def test_send_firmware():
+    fw = Firmware.load(DATA_DIR / '2.01.26_raw.bin')
+    with Emulator(baud=0, bootloader='2.00.06') as emu:
+        radio = UVK5(emu.port)
+        radio.send_firmware(fw, progress=lambda *a: None)
+        radio.close()
+    assert emu.flash_version == fw.version
+    assert emu.flash[:len(fw)] == fw
+
+
+def test_flash_lost_ack():
+    # beacons keep coming, but the bootloader never answers this frame
+    with Emulator(baud=0, bootloader='2.00.06') as emu:
+        radio = UVK5(emu.port)
+        radio.retry.retries = 0
+        radio.base_timeout = 0.5
+        with pytest.raises(TimeoutError):
+            radio.write_fw(0, bytes(FrameCodec().encode(UVK5.CMD_VERSION_REQ)))
+        radio.close()
+
+
+def test_emulator_baud():
+    data = os.urandom(0x80)
+    frame = UVK5(None).codec.encode_write(UVK5.CMD_SETTINGS_WRITE_REQ, 0, data)
+    with Emulator(baud=2400) as emu:
+        radio = UVK5(emu.port)
+        started = monotonic()
+        radio.write_mem(0, data)
+        # both directions pay for the line
+        assert monotonic() - started >= (len(frame) + 12) * 10 / 2400
+        radio.close()
+    assert emu.eeprom[:0x80] == data
+
+
+def interrupt_after(monkeypatch, obj, name, calls):
+    orig = getattr(obj, name)
+    def wrapper(*args):
+        wrapper.calls += 1
+        if wrapper.calls > calls:
+            raise KeyboardInterrupt
+        return orig(*args)
+    wrapper.calls = 0
+    monkeypatch.setattr(obj, name, wrapper)
+
+
+def test_dump_resume(emu, radio, tmp_path, monkeypatch):
+    path = tmp_path / 'backup.bin'
+    with monkeypatch.context() as m:
+        interrupt_after(m, radio, 'read_range', 2)
+        with pytest.raises(KeyboardInterrupt):
+            radio.dump_eeprom(path)
+    part = path.with_name('backup.bin.part')
+    done = part.stat().st_size
+    assert done and part.read_bytes() == EEPROM[:done]
+
+    reads = []
+    orig = radio.read_range
+    monkeypatch.setattr(radio, 'read_range', lambda o, n: reads.append(o) or orig(o, n))
+    radio.dump_eeprom(path)
+    assert reads[0] == done
+    assert path.read_bytes() == EEPROM
+    assert not part.exists()
+
+
+@pytest.mark.parametrize('calibration', [False, '0', 'no', 'yes'])
+def test_restore_resume(emu, radio, tmp_path, monkeypatch, calibration):
+    image = os.urandom(UVK5.EEPROM_SIZE)
+    path = tmp_path / 'backup.bin'
+    path.write_bytes(image)
+    with monkeypatch.context() as m:
+        interrupt_after(m, radio, 'write_block_verified', 3)
+        with pytest.raises(KeyboardInterrupt):
+            radio.restore_eeprom(path, 0, calibration)
+    progress = path.with_name('backup.bin.restore')
+    assert progress.read_text() == str(3 * UVK5.BLOCK_SIZE)
+
+    writes = emu.requests[UVK5.CMD_SETTINGS_WRITE_REQ]
+    radio.restore_eeprom(path, 0, calibration)
+    end = UVK5.EEPROM_SIZE if calibration == 'yes' else UVK5.CALIBRATION_START
+    assert emu.requests[UVK5.CMD_SETTINGS_WRITE_REQ] - writes == end // UVK5.BLOCK_SIZE - 3
+    assert emu.eeprom[:end] == image[:end]
+    assert emu.eeprom[end:] == EEPROM[end:]
+    assert not progress.exists()
+
+
+@pytest.mark.parametrize('calibration', ['0', 'yes'])
+def test_write_eeprom(emu, radio, tmp_path, calibration):
+    image = bytearray(EEPROM)
+    image[0x100] ^= 0xFF
+    image[UVK5.CALIBRATION_START + 0x10] ^= 0xFF
+    path = tmp_path / 'new.bin'
+    path.write_bytes(image)
+    assert radio.write_eeprom(path, None, 0, calibration) == f'{1 + (calibration == "yes")} blocks changed'
+    assert emu.eeprom[:UVK5.CALIBRATION_START] == image[:UVK5.CALIBRATION_START]
+    assert emu.eeprom[UVK5.CALIBRATION_START:] == (image if calibration == 'yes' else EEPROM)[UVK5.CALIBRATION_START:]
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_upload_lossy(seed):
+    from patch import PATCH
+    with Emulator(baud=0, drop=0.05, corrupt=0.02, seed=seed) as emu:
+        radio = UVK5(emu.port)
+        radio.retry.backoff = 0
+        radio.base_timeout = 0.3
+        assert radio.upload(UVK5.CMD_PATCH_WRITE, bytes(PATCH)) == UVK5.UPLOAD_CHUNK_SIZES[0]
+        radio.close()
+    assert emu.patch[:len(PATCH)] == bytes(PATCH)
+
+
+def test_flash_short_ack(monkeypatch):
+    fw = bytes(range(256))
+    with Emulator(baud=0, bootloader='2.00.06') as emu:
+        radio = UVK5(emu.port)
+        radio.retry.backoff = 0
+        replies = []
+        orig = radio._read_reply
+
+        def read_reply(cmd_id):
+            data = orig(cmd_id)
+            replies.append(data)
+            # first ack arrives truncated
+            return data[:4] if len(replies) == 1 else data
+
+        monkeypatch.setattr(radio, '_read_reply', read_reply)
+        radio.write_fw(0, prepare_flash_frames(fw)[0][2])
+        radio.close()
+    assert len(replies) == 2
+    assert emu.flash[:256] == fw
+
+
+def test_emulator_stop_mid_reply():
+    with Emulator(baud=2400) as emu:
+        radio = UVK5(emu.port)
+        radio.write(radio.codec.encode(UVK5.CMD_SETTINGS_REQ, i2b32(0) + i2b16(0x80)))
+        sleep(0.1)
+    radio.close()
+
+    # the next pty reuses the fds, the old reply must not show up there
+    with Emulator(baud=0) as emu:
+        radio = UVK5(emu.port)
+        sleep(1)
+        assert not radio.in_waiting
+        radio.close()
+
+
+def test_emulator_latency():
+    with Emulator(baud=0, latency=0.2) as emu:
+        radio = UVK5(emu.port)
+        started = monotonic()
+        radio.get_version()
+        assert monotonic() - started >= 0.2
+        radio.close()
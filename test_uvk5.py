@@ -0,0 +1,100 @@
+from itertools import cycle
+
+import pytest
+
+import uvk5
+from uvk5 import DATA_DIR, KEY_COMM, KEY_FW
+
+STOCK = (DATA_DIR / '2.01.26.bin').read_bytes()
+STOCK_RAW = (DATA_DIR / '2.01.26_raw.bin').read_bytes()
+
+
+def xor_cycle(var, key):
+    return bytes(a ^ b for a, b in zip(var, cycle(key)))
+
+
+@pytest.fixture(params=['numpy', 'int'])
+def xor_path(request, monkeypatch):
+    if request.param == 'numpy':
+        if uvk5.numpy is None:
+            pytest.skip('numpy not installed')
+    else:
+        monkeypatch.setattr(uvk5, 'numpy', None)
+    return request.param
+
+
+@pytest.mark.parametrize('data', [STOCK, STOCK_RAW, b'', b'\x01', STOCK[:77]])
+def test_xor_matches_cycle(xor_path, data):
+    assert uvk5.xor_fw(data) == xor_cycle(data, KEY_FW)
+    assert uvk5.xor_comm(data) == xor_cycle(data, KEY_COMM)
+    assert uvk5.xor_fw(bytearray(data)) == xor_cycle(data, KEY_FW)
+
+
+def test_xor_key_offset(xor_path):
+    assert uvk5.xor_key(STOCK[5:300], KEY_FW, 5) == xor_cycle(STOCK, KEY_FW)[5:300]
+
+
+def test_xor_key_into(xor_path):
+    buf = bytearray(STOCK)
+    uvk5.xor_key_into(memoryview(buf), KEY_FW)
+    assert buf == xor_cycle(STOCK, KEY_FW)
+
+
+def test_decrypt_encrypt_roundtrip(xor_path):
+    decrypted, version = uvk5.decrypt(STOCK)
+    assert version == '2.01.26'
+    assert decrypted == STOCK_RAW
+    assert uvk5.encrypt(decrypted, version) == STOCK
+
+
+def test_decrypt_into_encrypt_into(xor_path):
+    buf = bytearray(STOCK)
+    size, version = uvk5.decrypt_into(memoryview(buf))
+    assert buf[:size] == STOCK_RAW
+    out = bytearray(uvk5.encrypted_size(size))
+    assert uvk5.encrypt_into(out, buf[:size], version) == STOCK
+
+
+def test_firmware_load(xor_path):
+    for path in ('2.01.26.bin', '2.01.26_raw.bin'):
+        fw = uvk5.Firmware.load(DATA_DIR / path)
+        assert fw == STOCK_RAW
+        assert fw.version == '2.01.26'
+
+
+@pytest.mark.parametrize('grow', [-100, 0, 100])
+def test_apply_delta(grow):
+    src = uvk5.Firmware(STOCK_RAW, '2.01.26')
+    dst = uvk5.Firmware(STOCK_RAW[:len(STOCK_RAW) + min(grow, 0)] + b'\x5a' * max(grow, 0), '2.01.26')
+    dst[0x100:0x104] = b'\x01\x02\x03\x04'
+    delta = src.make_delta(dst)
+
+    fw = uvk5.Firmware(STOCK_RAW, '2.01.26')
+    fw.apply_delta(delta)
+    assert fw == dst
+
+    bad = bytearray(delta)
+    bad[15] ^= 0xFF  # dst_crc
+    fw = uvk5.Firmware(STOCK_RAW, '2.01.26')
+    with pytest.raises(ValueError):
+        fw.apply_delta(bytes(bad))
+    assert fw == STOCK_RAW
+
+
+@pytest.mark.parametrize('version', ['2.01.17', '2.01.19', '2.01.26', '3.00.10'])
+def test_addrdb_versions(version):
+    fw = uvk5.Firmware(STOCK_RAW, version)
+    fw.__class__ = uvk5.FirmwareModifiable
+    fw.addresses = uvk5.addrdb.get(version)['addresses']
+    assert len(fw.ADR_BANDS) == 7
+    assert sorted(fw.get_available_mods()) == ['unlimit_rx', 'unlimit_tx']
+
+
+def test_modder_zero_value(monkeypatch):
+    import modder
+    entry = uvk5.addrdb.get('2.01.26')
+    mods = {**entry['mods'], 'limits': {**entry['mods']['limits'], 'l1': 0}}
+    monkeypatch.setattr(uvk5.addrdb, 'get', lambda version: {**entry, 'mods': mods})
+    fw, _ = uvk5.decrypt(modder.modify(DATA_DIR / '2.01.26.bin'))
+    l1 = entry['addresses']['limits']['l1']
+    assert fw[l1:l1+4] == bytes(4)
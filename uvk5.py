@@ -1,16 +1,28 @@
 #!/usr/bin/env python3
 
 from binascii import crc_hqx
-from itertools import cycle
+from collections import namedtuple
+from functools import lru_cache
+from hashlib import blake2b
 import os
+import re
 import struct
 from sys import stderr, argv
 from pathlib import Path
-from time import time
+from time import time, monotonic, sleep
 from io import StringIO
+import mmap
 
 from serial import Serial
 
+import addrdb
+from eepromcache import EepromCache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 DATA_DIR = Path(__file__).parent / 'data'
 
 KEY_FW = (DATA_DIR / 'key-fw.bin').read_bytes()
@@ -30,12 +42,39 @@ def eprint(*args, **kwargs):
     print(*args, **kwargs, file=stderr)
 
 
+@lru_cache(maxsize=32)
+def keystream(key, size, offset=0):
+    start = offset % len(key)
+    repeats = (start + size) // len(key) + 1
+    return (key * repeats)[start:start+size]
+
+
+def xor_key(var, key, offset=0):
+    size = len(var)
+    ks = keystream(key, size, offset)
+    if numpy is not None:
+        a = numpy.frombuffer(var, dtype=numpy.uint8)
+        b = numpy.frombuffer(ks, dtype=numpy.uint8)
+        return numpy.bitwise_xor(a, b).tobytes()
+    return (b2i(var) ^ b2i(ks)).to_bytes(size, 'little')
+
+
+def xor_key_into(buf, key, offset=0):
+    if numpy is not None:
+        a = numpy.frombuffer(buf, dtype=numpy.uint8)
+        b = numpy.frombuffer(keystream(key, len(a), offset), dtype=numpy.uint8)
+        numpy.bitwise_xor(a, b, out=a)
+    else:
+        buf[:] = xor_key(buf, key, offset)
+    return buf
+
+
 def xor_fw(var):
-    return bytes(a ^ b for a, b in zip(var, cycle(KEY_FW)))
+    return xor_key(var, KEY_FW)
 
 
 def xor_comm(var):
-    return bytes(a ^ b for a, b in zip(var, cycle(KEY_COMM)))
+    return xor_key(var, KEY_COMM)
 
 
 def make_16byte_version(version):
@@ -66,90 +105,332 @@ def is_decrypted(data):
     return data[:4] == b'\x88\x13\x00\x20' or data[:4] == b'\x88\x11\x00\x20'
 
 
+# markers preceding the "k5_<version>" string in decrypted images
+VERSION_MARKERS = (
+    bytes.fromhex('2135D5401303E980'),
+)
+
+_version_cache = {}
+
+
+@lru_cache(maxsize=32)
+def compile_signatures(signatures):
+    alternatives = b'|'.join(re.escape(sig) for sig in signatures)
+    return re.compile(b'(?=(' + alternatives + b'))', re.DOTALL)
+
+
+def find_signatures(data, signatures=VERSION_MARKERS):
+    """Returns [(offset, signature), ...] for every (overlapping) match"""
+    pattern = compile_signatures(signatures)
+    return [(m.start(), m.group(1)) for m in pattern.finditer(data)]
+
+
 def search_for_version(data):
-    pre = bytes.fromhex('2135D5401303E980')
-    plen = len(pre)
-    for i in range(len(data)-plen):
-        if data[i:i+plen] == pre:
-            return data[i+plen:i+plen+16].decode(errors='ignore').rstrip('\x00').split('_')[1]
-    return 'unknown'
+    key = blake2b(data, digest_size=16).digest()
+    if key in _version_cache:
+        return _version_cache[key]
+
+    version = 'unknown'
+    for offset, marker in find_signatures(data):
+        start = offset + len(marker)
+        parts = bytes(data[start:start+16]).decode(errors='ignore').rstrip('\x00').split('_')
+        if len(parts) > 1:
+            version = parts[1]
+            break
+
+    _version_cache[key] = version
+    return version
+
+
+Hit = namedtuple('Hit', 'pattern offset context')
+Change = namedtuple('Change', 'offset old new length')
+
+DIFF_CHUNK = 256
+
+
+def as_buffer(data):
+    try:
+        memoryview(data)
+    except TypeError:
+        return bytes(data)
+    return data
+
+MASK_RE = re.compile(r'^(?:[0-9A-Fa-f]{2}|\?\??)(?:\s+(?:[0-9A-Fa-f]{2}|\?\??))*$')
+
+
+def pattern_to_regex(pattern):
+    # IDA-style masks like "5D E0 ?? ??" are parsed as hex, anything else is literal
+    if isinstance(pattern, str):
+        if MASK_RE.match(pattern) and (' ' in pattern or '?' in pattern):
+            return b''.join(
+                b'.' if tok.startswith('?') else re.escape(bytes.fromhex(tok))
+                for tok in pattern.split()
+            )
+        pattern = pattern.encode()
+    if not pattern:
+        raise ValueError('Empty pattern')
+    return re.escape(bytes(pattern))
+
+
+def _diff_runs_numpy(a, b, size):
+    differ = numpy.frombuffer(a, numpy.uint8, size) != numpy.frombuffer(b, numpy.uint8, size)
+    edges = numpy.diff(differ.astype(numpy.int8), prepend=0, append=0)
+    starts = numpy.flatnonzero(edges == 1).tolist()
+    stops = numpy.flatnonzero(edges == -1).tolist()
+    return list(zip(starts, stops))
+
+
+def _diff_runs_chunked(a, b, size):
+    runs = []
+    for base in range(0, size, DIFF_CHUNK):
+        end = min(base + DIFF_CHUNK, size)
+        ca, cb = a[base:end], b[base:end]
+        if ca == cb:
+            continue
+        for i, (x, y) in enumerate(zip(ca, cb), base):
+            if x == y:
+                continue
+            if runs and runs[-1][1] == i:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+    return runs
 
 
+def diff(a, b, gap=0):
+    """Returns [Change(offset, old, new, length), ...], runs closer than gap are merged"""
+    a, b = as_buffer(a), as_buffer(b)
+    la, lb = len(a), len(b)
+    size = min(la, lb)
+
+    runs = (_diff_runs_numpy if numpy is not None else _diff_runs_chunked)(a, b, size)
+    if la != lb:
+        runs.append((size, max(la, lb)))
+
+    merged = []
+    for start, stop in runs:
+        if merged and start - merged[-1][1] <= gap:
+            merged[-1][1] = stop
+        else:
+            merged.append([start, stop])
+
+    return [
+        Change(start, bytes(a[start:stop]), bytes(b[start:stop]), stop - start)
+        for start, stop in merged
+    ]
+
+
+DELTA_MAGIC = b'K5DL'
+DELTA_VERSION = 1
+DELTA_HEADER = struct.Struct('<4sBIIHHI')  # magic, version, src len, dst len, src crc, dst crc, count
+DELTA_RECORD = struct.Struct('<II')  # offset, length
+
+
+def make_delta(src, dst, gap=DELTA_RECORD.size):
+    src, dst = as_buffer(src), as_buffer(dst)
+    changes = diff(src, dst, gap)
+    header = DELTA_HEADER.pack(
+        DELTA_MAGIC, DELTA_VERSION, len(src), len(dst),
+        crc_hqx(src, 0), crc_hqx(dst, 0), len(changes),
+    )
+    records = (DELTA_RECORD.pack(ch.offset, len(ch.new)) + ch.new for ch in changes)
+    return header + b''.join(records)
+
+
+def parse_delta(delta):
+    magic, version, src_len, dst_len, src_crc, dst_crc, count = DELTA_HEADER.unpack_from(delta)
+    if magic != DELTA_MAGIC or version != DELTA_VERSION:
+        raise ValueError('Bad delta header', magic, version)
+
+    records = []
+    pos = DELTA_HEADER.size
+    for _ in range(count):
+        offset, length = DELTA_RECORD.unpack_from(delta, pos)
+        pos += DELTA_RECORD.size
+        records.append((offset, bytes(delta[pos:pos+length])))
+        pos += length
+
+    return (src_len, dst_len, src_crc, dst_crc, records)
+
+
+class Scanner:
+    def __init__(self, patterns, context=32) -> None:
+        if not isinstance(patterns, dict):
+            patterns = {p: p for p in patterns}
+        self.ids = list(patterns)
+        self.context = context
+        regexes = [pattern_to_regex(p) for p in patterns.values()]
+        self.singles = [re.compile(r, re.DOTALL) for r in regexes]
+        groups = b'|'.join(b'(' + r + b')' for r in regexes)
+        self.combined = re.compile(b'(?=' + groups + b')', re.DOTALL)
+
+    def scan(self, data):
+        data = as_buffer(data)
+        hits = []
+        for m in self.combined.finditer(data):
+            pos = m.start()
+            first = m.lastindex - 1
+            # alternation stops at the first match, check the rest explicitly
+            for i in range(first, len(self.singles)):
+                if i == first or self.singles[i].match(data, pos):
+                    ctx = bytes(data[pos:pos+self.context])
+                    hits.append(Hit(self.ids[i], pos, ctx))
+        return hits
+
+    def scan_files(self, paths):
+        results = {}
+        for path in paths:
+            with FirmwareMap.load(path) as fw:
+                results[str(path)] = self.scan(fw.mm if not fw.encrypted else fw)
+        return results
+
+
+def decrypted_size(encrypted_len):
+    return encrypted_len - (V_END - V_START) - CRC_LEN
+
+
+def encrypted_size(decrypted_len):
+    return decrypted_len + (V_END - V_START) + CRC_LEN
+
+
+# decrypts in place, image is buf[:size] after call
+def decrypt_into(buf):
+    m = memoryview(buf)
+    xor_key_into(m, KEY_FW)
+    version = bytes(m[V_START:V_END]).decode().rstrip('\x00')
+    size = decrypted_size(len(m))
+    m[V_START:size] = m[V_END:-CRC_LEN]
+    return (size, version)
+
+
+# out must be encrypted_size(len(data)) long
+def encrypt_into(out, data, version='2.01.26'):
+    m = memoryview(out)
+    if len(m) != encrypted_size(len(data)):
+        raise ValueError('Bad output buffer size', len(m))
+    m[:V_START] = data[:V_START]
+    m[V_START:V_END] = make_16byte_version(version)
+    m[V_END:-CRC_LEN] = data[V_START:]
+    xor_key_into(m[:-CRC_LEN], KEY_FW)
+    m[-CRC_LEN:] = crc16(m[:-CRC_LEN])
+    return out
+
 
 def decrypt(data):
-    decrypted = xor_fw(data)
-    version = decrypted[V_START:V_END].decode().rstrip('\x00')
-    return (decrypted[:V_START] + decrypted[V_END:-CRC_LEN], version)
+    decrypted = bytearray(data)
+    size, version = decrypt_into(decrypted)
+    del decrypted[size:]
+    return (bytes(decrypted), version)
 
 
 def encrypt(data, version='2.01.26'):
-    v = make_16byte_version(version)
-    encrypted = xor_fw(data[:V_START] + v + data[V_START:])
-    checksum = crc16(encrypted)
-    return encrypted + checksum
+    return bytes(encrypt_into(bytearray(encrypted_size(len(data))), data, version))
+
+
+class PatchPlan:
+    def __init__(self) -> None:
+        self.writes = []  # (mod, addr, data)
+        self.mod = None
+
+    def add(self, addr, data):
+        self.writes.append((self.mod, addr, bytes(data)))
+
+    def conflicts(self):
+        found = []
+        last = None
+        for w in sorted(self.writes, key=lambda w: w[1]):
+            if last and w[1] < last[1] + len(last[2]) and w[0] != last[0]:
+                found.append((last, w))
+            if not last or w[1] + len(w[2]) > last[1] + len(last[2]):
+                last = w
+        return found
+
+    def apply(self, fw):
+        undo = []
+        for _, addr, data in self.writes:
+            undo.append((addr, bytes(fw[addr:addr+len(data)])))
+            fw[addr:addr+len(data)] = data
+        return undo
 
 
 class Firmware(bytearray):
+    _plan = None
+
     @classmethod
     def load(cls, path):
-        data = Path(path).read_bytes()
-        if is_decrypted(data):
-            version = search_for_version(data)
+        path = Path(path)
+        fw = cls(path.stat().st_size, 'unknown')
+        with path.open('rb') as f:
+            f.readinto(fw)
+
+        if is_decrypted(fw):
+            fw.version = search_for_version(fw)
         else:
-            data, version = decrypt(data)
+            size, fw.version = decrypt_into(fw)
+            del fw[size:]
 
-        return globals().get(f'Firmware_{version.replace(".", "_")}', cls)(data, version)
+        entry = addrdb.get(fw.version)
+        if entry:
+            fw.__class__ = FirmwareModifiable
+            fw.addresses = entry['addresses']
+        return fw
 
     def __init__(self, data, version) -> None:
         super().__init__(data)
         self.version = version
+        self.undo_log = []
 
 
-    def compare(self, fw):
-        a = None
-        la = len(self)
-        lb = len(fw)
-        changes = {}
-        for i in range(min(la, lb)):
-            differ = self[i] != fw[i]
-            if not differ:
-                a = None
-                continue
-
-            if not a:
-                a = '0x%x' % i
-                changes[a] = [bytearray(), bytearray()]
-
-            changes[a][0].append(self[i])
-            changes[a][1].append(fw[i])
+    def compare(self, fw, gap=0):
+        return diff(self, fw, gap)
 
+    def search(self, *patterns):
+        return Scanner(patterns).scan(self)
 
-        for addr, ch in changes.items():
-            print(f'{addr}:', ch[0].hex(), ch[1].hex())
 
+    def patch_single(self, addr, new_value, size=4):
+        if isinstance(new_value, (bytes, bytearray)):
+            new_bytes = bytes(new_value)
+        else:
+            new_bytes = int(new_value).to_bytes(size, 'little')
 
-    def search(self, q):
+        if self._plan is not None:
+            self._plan.add(addr, new_bytes)
+        else:
+            self[addr:addr+len(new_bytes)] = new_bytes
 
-        search_for_len = len(q)
+    def make_delta(self, fw):
+        return make_delta(self, fw)
 
-        for i in range(len(self)):
-            if self[i:i+search_for_len] == q:
-                print(f'[{i}]: {self[i:i+32]}')
+    def apply_delta(self, delta):
+        src_len, dst_len, src_crc, dst_crc, records = parse_delta(delta)
+        if len(self) != src_len or crc_hqx(self, 0) != src_crc:
+            raise ValueError('Delta does not match source image')
 
+        # Keep what gets overwritten so a bad delta leaves the image untouched
+        tail = bytes(self[dst_len:])
+        if dst_len < src_len:
+            del self[dst_len:]
+        else:
+            self.extend(bytes(dst_len - src_len))
 
+        undo = []
+        for offset, data in records:
+            undo.append((offset, bytes(self[offset:offset+len(data)])))
+            self[offset:offset+len(data)] = data
 
-    def patch_single(self, addr, new_value, size=4):
-        old_bytes = self[addr:addr+size]
-        old_value = int.from_bytes(old_bytes, 'little')
-        new_bytes = int(new_value).to_bytes(size, 'little')
-        self[addr:addr+size] = new_bytes
+        if crc_hqx(self, 0) != dst_crc:
+            for offset, data in reversed(undo):
+                self[offset:offset+len(data)] = data
+            self[min(src_len, dst_len):] = tail
+            raise ValueError('Patched image CRC mismatch')
 
 
     def write(self, path=None):
-        encrypted = encrypt(self, self.version)
+        encrypted = encrypt_into(bytearray(encrypted_size(len(self))), self, self.version)
 
         if path:
-            pass
+            Path(path).write_bytes(encrypted)
         else:
             os.write(1, encrypted)
 
@@ -161,14 +442,126 @@ class Firmware(bytearray):
             os.write(1, self)
 
 
+class FirmwareMap:
+    PAGE_SIZE = 0x1000
+
+    @classmethod
+    def load(cls, path):
+        with Path(path).open('rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mm)
+
+    def __init__(self, mm) -> None:
+        self.mm = mm
+        self.encrypted = not is_decrypted(mm[:4])
+        self._page = lru_cache(maxsize=64)(self._decrypt_page)
+
+        if self.encrypted:
+            if len(mm) < V_END + CRC_LEN:
+                raise ValueError('Too small for encrypted firmware', len(mm))
+            self.size = decrypted_size(len(mm))
+            v = xor_key(mm[V_START:V_END], KEY_FW, V_START)
+            self.version = v.decode().rstrip('\x00')
+        else:
+            self.size = len(mm)
+            self.version = search_for_version(mm)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                return bytes(self[i] for i in range(start, stop, step))
+            if start >= stop:
+                return b''
+            first, last = start // self.PAGE_SIZE, (stop - 1) // self.PAGE_SIZE
+            data = b''.join(self._page(p) for p in range(first, last + 1))
+            offset = first * self.PAGE_SIZE
+            return data[start - offset:stop - offset]
+
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('FirmwareMap index out of range')
+        return self._page(key // self.PAGE_SIZE)[key % self.PAGE_SIZE]
+
+    def __bytes__(self):
+        return self[:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._page.cache_clear()
+        self.mm.close()
+
+    def _raw(self, start, stop):
+        if not self.encrypted:
+            return self.mm[start:stop]
+        # image skips the 16-byte version block stored at V_START
+        if stop <= V_START:
+            return xor_key(self.mm[start:stop], KEY_FW, start)
+        if start >= V_START:
+            return xor_key(self.mm[start+16:stop+16], KEY_FW, start+16)
+        return self._raw(start, V_START) + self._raw(V_START, stop)
+
+    def _decrypt_page(self, page):
+        start = page * self.PAGE_SIZE
+        return self._raw(start, min(start + self.PAGE_SIZE, self.size))
+
+    compare = Firmware.compare
+    search = Firmware.search
+
+
 class FirmwareModifiable(Firmware):
+    addresses = {}
+
+    @property
+    def ADR_BANDS(self):
+        bands = self.addresses.get('bands', {})
+        return [[bands[f'b{i}_1'], bands[f'b{i}_2']] for i in range(1, 8)]
+
+    @property
+    def ADR_LIMITS(self):
+        limits = self.addresses.get('limits', {})
+        return [limits['l1'], limits['l2']]
+
+    @property
+    def ADR_TX_CHECK(self):
+        return self.addresses.get('tx', {}).get('tx_check')
+
+    def plan_mods(self, mod_names):
+        plan = PatchPlan()
+        self._plan = plan
+        try:
+            for mod in mod_names:
+                plan.mod = mod
+                getattr(self, f'mod_{mod}')()
+        finally:
+            del self._plan
+        return plan
+
     def apply_mods(self, mod_names):
-        for mod in mod_names:
-            getattr(self, f'mod_{mod}')()
+        plan = self.plan_mods(mod_names)
+        conflicts = plan.conflicts()
+        if conflicts:
+            raise ValueError('Overlapping mod writes', conflicts)
+        self.undo_log.append(plan.apply(self))
+        return plan
+
+    def revert(self, steps=1):
+        for _ in range(min(steps, len(self.undo_log))):
+            for addr, data in reversed(self.undo_log.pop()):
+                self[addr:addr+len(data)] = data
 
     def get_available_mods(self):
         for func in dir(self):
-            if callable(getattr(self, func)) and func.startswith('mod_'):
+            if func.startswith('mod_') and callable(getattr(self, func)):
                 yield func[4:]
 
     def mod_unlimit_rx(self):
@@ -178,39 +571,245 @@ class FirmwareModifiable(Firmware):
         self.patch_single(self.ADR_LIMITS[1], 1_300_000_000//10)
 
     def mod_unlimit_tx(self):
+        if self.ADR_TX_CHECK is None:
+            raise ValueError('No TX check address for version', self.version)
         self.patch_single(self.ADR_TX_CHECK, b'\x5d\xe0', 2)
 
 
-class Firmware_2_01_17(FirmwareModifiable):
-    ADR_BANDS = [
-        [0xEAE4,0xEB00],
-        [0xEAE8,0xEB04],
-        [0xEAEC,0xEB08],
-        [0xEAF0,0xEB0C],
-        [0xEAF4,0xEB10],
-        [0xEAF8,0xEB14],
-        [0xEAFC,0xEB18],
-    ]
-    ADR_LIMITS = [0x1AF0, 0x1AF4]
-
-
-class Firmware_2_01_26(FirmwareModifiable):
-    ADR_BANDS = [
-        [0xE074, 0xE090],
-        [0xE078, 0xE094],
-        [0xE07C, 0xE098],
-        [0xE080, 0xE09C],
-        [0xE084, 0xE0A0],
-        [0xE088, 0xE0A4],
-        [0xE08C, 0xE0A8],
-    ]
-    ADR_LIMITS = [0x150C, 0x1510]
-    ADR_TX_CHECK = 0x180E
+def print_progress(done, total, speed=None):
+    rate = f' {speed:.0f} B/s' if speed is not None else ''
+    eprint(f'{done}/{total} ({done * 100 // total}%){rate}', end='\r' if done < total else '\n')
+
+
+def prepare_flash_frames(fw):
+    block_size = UVK5.FLASH_BLOCK_SIZE
+    codec = FrameCodec()  # bootloader frames carry no timestamp
+    last = (len(fw) - 1) // block_size * block_size
+    frames = []
+    for offset in range(0, len(fw), block_size):
+        data = bytes(fw[offset:offset+block_size])
+        head = UVK5.FLASH_SESSION + struct.pack('>HH', offset, last) + struct.pack('<HH', len(data), 0)
+        frames.append((offset, len(data), bytes(codec.encode(UVK5.CMD_FLASH_WRITE_REQ, head, data.ljust(block_size, b'\x00')))))
+    return frames
+
+
+def merge_ranges(ranges):
+    merged = []
+    for offset, size in sorted(ranges):
+        if merged and offset <= merged[-1][0] + merged[-1][1]:
+            end = max(merged[-1][0] + merged[-1][1], offset + size)
+            merged[-1][1] = end - merged[-1][0]
+        else:
+            merged.append([offset, size])
+    return merged
+
+
+def changed_blocks(image, current, offset=0, block_size=0x80):
+    blocks = set()
+    for ch in diff(image, current):
+        first = (offset + ch.offset) // block_size
+        last = (offset + ch.offset + ch.length - 1) // block_size
+        blocks.update(range(first, last + 1))
+    return [b * block_size for b in sorted(blocks)]
+
+
+CHANNEL_RANGES = [
+    (0x0F50, 16 * 200), # names
+    (0x0000, 16 * 200), # settings
+]
+
+
+def format_channels(names_set, settings_set):
+    out = StringIO()
+
+    names = [name.decode(errors='ignore').rstrip('\x00') for name in chunk(names_set, 16)]
+    settings = [(b2i(setting[:4])/100000.0, ) for setting in chunk(settings_set, 16)]
+
+    for i, name in enumerate(names):
+        if name:
+            print(f'{i+1:0>3}. {name: <16} {settings[i][0]:0<8} M', file=out)
+        else:
+            print(f'{i+1:0>3}. -', file=out)
+
+    return out.getvalue()
+
 
+class FrameCodec:
+    # AB CD, payload len, cmd id, data len | data ... | CRC, DC BA
+    HEADER = struct.Struct('<2sHHH')
+    FOOTER = struct.Struct('<H2s')
+
+    def __init__(self, timestamp=b'', size=0x200) -> None:
+        self.timestamp = timestamp
+        self.buf = bytearray(size)
+
+    def encode(self, cmd_id, head=b'', tail=b''):
+        """Frame with data = head + timestamp + tail, valid until next encode()"""
+        data_len = len(head) + len(self.timestamp) + len(tail)
+        payload_len = 4 + data_len
+        total = self.HEADER.size + data_len + self.FOOTER.size
+        if total > len(self.buf):
+            self.buf = bytearray(total)
+
+        m = memoryview(self.buf)
+        self.HEADER.pack_into(m, 0, UVK5.PREAMBLE, payload_len, cmd_id, data_len)
+        pos = self.HEADER.size
+        for part in (head, self.timestamp, tail):
+            m[pos:pos+len(part)] = part
+            pos += len(part)
+
+        crc = crc_hqx(m[4:pos], 0)
+        self.FOOTER.pack_into(m, pos, crc, UVK5.POSTAMBLE)
+        xor_key_into(m[4:pos+2], KEY_COMM)
+        return m[:total]
+
+    def encode_write(self, cmd_id, address, payload):
+        return self.encode(cmd_id, struct.pack('<HH', address, len(payload)), payload)
+
+
+class CrcError(ValueError):
+    pass
+
+
+# stock firmware sends FF FF (after deobfuscation) instead of a real CRC
+NO_CRC = b'\xff\xff'
+
+
+def check_crc(payload, strict=False):
+    crc = bytes(payload[-2:])
+    if crc == crc16(payload[:-2]) or (crc == NO_CRC and not strict):
+        return
+    raise CrcError('Bad response CRC', crc.hex())
+
+
+class RetryPolicy:
+    def __init__(self, retries=2, backoff=0.05, factor=2.0, per_cmd=None, strict_crc=False) -> None:
+        self.retries = retries
+        self.backoff = backoff
+        self.factor = factor
+        self.per_cmd = per_cmd or {}
+        self.strict_crc = strict_crc
+
+    def retries_for(self, cmd_id):
+        return self.per_cmd.get(cmd_id, self.retries)
+
+    def delay(self, attempt):
+        return self.backoff * self.factor ** attempt
+
+
+class LatencyStats:
+    BUCKETS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+    MIN_SAMPLES = 8
+    MAX_SAMPLES = 1000
+
+    def __init__(self, factor=3.0, min_timeout=0.2) -> None:
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.samples = {}
+        self.timeouts = {}
+
+    def record(self, cmd_id, seconds):
+        samples = self.samples.setdefault(cmd_id, [])
+        samples.append(seconds)
+        if len(samples) > self.MAX_SAMPLES:
+            del samples[0]
+
+    def record_timeout(self, cmd_id):
+        self.timeouts[cmd_id] = self.timeouts.get(cmd_id, 0) + 1
+
+    def percentile(self, cmd_id, p):
+        samples = sorted(self.samples.get(cmd_id, ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def histogram(self, cmd_id):
+        counts = [0] * (len(self.BUCKETS) + 1)
+        for v in self.samples.get(cmd_id, ()):
+            counts[next((i for i, b in enumerate(self.BUCKETS) if v <= b), len(self.BUCKETS))] += 1
+        return counts
+
+    def timeout_for(self, cmd_id, default):
+        if len(self.samples.get(cmd_id, ())) < self.MIN_SAMPLES:
+            return default
+        return min(default, max(self.min_timeout, self.percentile(cmd_id, 99) * self.factor))
+
+    def report(self):
+        out = StringIO()
+        labels = ['<=%gms' % (b * 1000) for b in self.BUCKETS] + ['>%gms' % (self.BUCKETS[-1] * 1000)]
+        for cmd_id in sorted(self.samples):
+            n = len(self.samples[cmd_id])
+            p50, p99 = self.percentile(cmd_id, 50), self.percentile(cmd_id, 99)
+            print(f'0x{cmd_id:04x}: n={n} p50={p50*1000:.1f}ms p99={p99*1000:.1f}ms timeouts={self.timeouts.get(cmd_id, 0)}', file=out)
+            hist = ' '.join(f'{l}:{c}' for l, c in zip(labels, self.histogram(cmd_id)) if c)
+            print(f'  {hist}', file=out)
+        return out.getvalue()
+
+
+def parse_payload(payload):
+    cmd_id = b2i(payload[:2])
+    data_len = b2i(payload[2:4])
+    return (cmd_id, payload[4:4+data_len])
+
+
+class FrameDecoder:
+    # longest payload we expect, anything bigger is garbage that looks like a header
+    MAX_PAYLOAD = 0x400
+
+    def __init__(self) -> None:
+        self.buf = bytearray()  # front deletes are O(1) on CPython bytearray
+        self.frames = []
+        self.dropped = 0
+
+    def feed(self, data):
+        self.buf += data
+        self._extract()
+        return self.frames
+
+    def pop(self):
+        return self.frames.pop(0) if self.frames else None
+
+    def reset(self):
+        self.dropped += len(self.buf)
+        self.buf.clear()
+        self.frames.clear()
+
+    def _drop(self, n):
+        self.dropped += n
+        del self.buf[:n]
+
+    def _extract(self):
+        buf = self.buf
+        while True:
+            start = buf.find(UVK5.PREAMBLE)
+            if start < 0:
+                # keep last byte, it may be the first half of a preamble
+                self._drop(max(len(buf) - 1, 0))
+                return
+            self._drop(start)
+            if len(buf) < 4:
+                return
+            size = b2i(buf[2:4])
+            if size > self.MAX_PAYLOAD:
+                self._drop(2)
+                continue
+            end = 4 + size + 2
+            if len(buf) < end + 2:
+                return
+            if buf[end:end+2] != UVK5.POSTAMBLE:
+                self._drop(2)
+                continue
+            self.frames.append(xor_comm(buf[4:end]))
+            del buf[:end+2]
 
 
 class UVK5(Serial):
     BLOCK_SIZE = 0x80
+    BLOCK_SIZES = (0xF0, 0xC0, 0x80)
+    READ_WINDOW = 4
+    PROBE_TIMEOUT = 0.5
+    UPLOAD_CHUNK_SIZES = (0x80, 0x40, 0x20, 0x10, 0x08)
+    UPLOAD_WINDOW = 4
 
     PREAMBLE = b'\xab\xcd'
     POSTAMBLE = b'\xdc\xba'
@@ -221,154 +820,450 @@ class UVK5(Serial):
     CMD_SETTINGS_RES = 0x051C
 
     CMD_SETTINGS_WRITE_REQ = 0x051D # then addr (0x0E70) then size (0x0160) then data
+    CMD_SETTINGS_WRITE_RES = 0x051E
+    CMD_PATCH_WRITE = 0x061D
+
+    # bootloader mode (power on with PTT pressed)
+    CMD_FLASH_BEACON = 0x0518
+    CMD_FLASH_WRITE_REQ = 0x0519
+    CMD_FLASH_WRITE_RES = 0x051A
+    CMD_FLASH_VERSION = 0x0530
+    FLASH_BLOCK_SIZE = 0x100
+    FLASH_SESSION = b'\x8a\x8d\x9f\x1d'
+    BOOTLOADER_TIMEOUT = 30
+
+    EEPROM_SIZE = 0x2000
+    CALIBRATION_START = 0x1E00
 
     def __init__(self, port: str | None = None) -> None:
         self.timestamp = i2b32(time())
+        self.codec = FrameCodec(self.timestamp)
+        self.block_size = UVK5.BLOCK_SIZE
+        self.probed = False
+        self.decoder = FrameDecoder()
+        self.retry = RetryPolicy()
+        self.stats = LatencyStats()
+        self.adaptive_timeout = True
+        self.base_timeout = 5
+        self.version = None
+        self.cache = None
+        self.cache_max_age = None
+        self.cache_checked = False
         super().__init__(port, 38400, timeout=5)
 
-    def send_firmware(self, fw:Firmware):
-        for block, data in enumerate(chunk(fw, UVK5.BLOCK_SIZE)):
-            offset = block * UVK5.BLOCK_SIZE
-            self.write_fw(offset, data)
-        exit(128)
-
-    def write_fw(self, offset, data):
-        eprint('FW write not implemented yet', offset, len(data))
+    def send_firmware(self, fw:Firmware, progress=None):
+        progress = progress or print_progress
+        # everything CPU-bound is done before the radio is waiting for us
+        frames = prepare_flash_frames(fw)
+        total = len(fw)
+
+        bootloader = self.wait_bootloader()
+        eprint('Bootloader:', bootloader)
+        self.write(FrameCodec().encode(UVK5.CMD_FLASH_VERSION, fw.version.encode().ljust(16, b'\x00')))
+
+        started = monotonic()
+        done = 0
+        for offset, size, frame in frames:
+            self.write_fw(offset, frame)
+            done += size
+            progress(done, total, done / max(monotonic() - started, 1e-6))
+
+        return done / max(monotonic() - started, 1e-6)
+
+    def wait_bootloader(self, timeout=BOOTLOADER_TIMEOUT):
+        deadline = monotonic() + timeout
+        self.timeout = min(self.base_timeout, 1)
+        while monotonic() < deadline:
+            try:
+                cmd_id, data = self._read_response()
+            except (ValueError, TimeoutError):
+                continue
+            if cmd_id == UVK5.CMD_FLASH_BEACON:
+                return data[16:32].decode(errors='ignore').rstrip('\x00')
+        raise TimeoutError('No bootloader found, power on radio with PTT pressed')
+
+    def write_fw(self, offset, frame):
+        retries = self.retry.retries_for(UVK5.CMD_FLASH_WRITE_REQ)
+        self.set_timeout_for(UVK5.CMD_FLASH_WRITE_REQ)
+        for attempt in range(retries + 1):
+            try:
+                started = monotonic()
+                self.write(frame)
+                data = self._read_reply(UVK5.CMD_FLASH_WRITE_RES)
+                if len(data) < 7 or int.from_bytes(data[4:6], 'big') != offset or data[6] != 0:
+                    raise ValueError('Flash write failed at 0x%04x' % offset, data.hex())
+                self.stats.record(UVK5.CMD_FLASH_WRITE_REQ, monotonic() - started)
+                return
+            except (ValueError, TimeoutError):
+                if attempt == retries:
+                    raise
+                self.resync(attempt)
+
+    def _read_reply(self, cmd_id):
+        # bootloader keeps sending beacons, skip them
+        deadline = monotonic() + self.timeout
+        while monotonic() < deadline:
+            res_id, data = self._read_response()
+            if res_id == cmd_id:
+                return data
+        raise TimeoutError(f'No response from {self.port}')
 
     def get_version(self):
-        return self.cmd(UVK5.CMD_VERSION_REQ)[1][:10].decode().rstrip('\x00')
+        self.version = self.cmd(UVK5.CMD_VERSION_REQ)[1][:10].decode().rstrip('\x00')
+        return self.version
+
+    def use_cache(self, max_age=None, cache_dir=None):
+        version = self.version or self.get_version()
+        kwargs = {'cache_dir': cache_dir} if cache_dir else {}
+        self.cache = EepromCache(self.port, version, UVK5.EEPROM_SIZE, UVK5.BLOCK_SIZE, **kwargs)
+        self.cache_max_age = max_age
+        self.cache_checked = False
+        return self.cache
+
+    def check_cache(self, ranges):
+        # same port and version may still be another radio, compare one cached block first
+        self.cache_checked = True
+        size = self.cache.block_size
+        need = self.cache.missing(ranges)
+        for o, n in ranges:
+            for b in self.cache.blocks(o, n):
+                if (b * size, size) in need:
+                    continue
+                if self.read_range(b * size, size) != self.cache.get(b * size, size):
+                    self.cache.invalidate()
+                return
 
     def read_mem(self, offset, size):
         return self.cmd(UVK5.CMD_SETTINGS_REQ, i2b32(offset) + i2b16(size))
 
-    def write_patch(self):
-        from patch import PATCH
-        print(len(PATCH))
-        def divide_chunks(l, n): 
-            for i in range(0, len(l), n):  
-                yield l[i:i + n]
-        offset = 0
-        for chunk in divide_chunks(PATCH,8):
-            print(f"Write at {offset}...")
-            self.cmdw(0x061D, offset, bytes(chunk))
-            offset += len(chunk)
+    def probe_block_size(self):
+        # once per session; misses are expected, keep them out of stats
+        self.probed = True
+        self.timeout = UVK5.PROBE_TIMEOUT
+        for size in UVK5.BLOCK_SIZES:
+            try:
+                self.write(self._cmd_make_req(UVK5.CMD_SETTINGS_REQ, i2b32(0) + i2b16(size)))
+                cmd_id, data = self._read_response()
+            except (ValueError, TimeoutError):
+                self.reset_input_buffer()
+                self.decoder.reset()
+                continue
+            if cmd_id == UVK5.CMD_SETTINGS_RES and len(data) == size + 4:
+                self.block_size = size
+                break
+        return self.block_size
+
+    def read_range(self, offset, size, block_size=None, window=READ_WINDOW):
+        if not (block_size or self.probed):
+            self.probe_block_size()
+        block_size = block_size or self.block_size
+        blocks = [(o, min(block_size, offset + size - o)) for o in range(offset, offset + size, block_size)]
+        out = bytearray(size)
+        pending = {}
+        sent = {}
+        failures = {}
+        retries = self.retry.retries_for(UVK5.CMD_SETTINGS_REQ)
+        self.set_timeout_for(UVK5.CMD_SETTINGS_REQ)
+
+        while blocks or pending:
+            while blocks and len(pending) < window:
+                o, n = blocks.pop(0)
+                self.write(self._cmd_make_req(UVK5.CMD_SETTINGS_REQ, i2b32(o) + i2b16(n)))
+                pending[o & 0xFFFF] = (o, n)
+                sent[o] = monotonic()
+
+            try:
+                cmd_id, data = self._read_response()
+                o, n = pending.get(b2i(data[:2]), (None, None))
+                if cmd_id != UVK5.CMD_SETTINGS_RES or o is None or len(data) != n + 4:
+                    raise ValueError('Bad read response', cmd_id, data[:4])
+                del pending[o & 0xFFFF]
+                self.stats.record(UVK5.CMD_SETTINGS_REQ, monotonic() - sent[o])
+            except (ValueError, TimeoutError) as e:
+                if isinstance(e, TimeoutError):
+                    self.stats.record_timeout(UVK5.CMD_SETTINGS_REQ)
+                # resend only blocks still in flight
+                for o, n in pending.values():
+                    failures[o] = failures.get(o, 0) + 1
+                    if failures[o] > retries:
+                        raise
+                self.resync(max(failures.values(), default=1) - 1)
+                blocks = sorted(pending.values()) + blocks
+                pending.clear()
+                continue
 
-    def cmd(self, id, body = b''):
-        self.write(self._cmd_make_req(id, body))
-        preamble = self.read(2)
+            out[o-offset:o-offset+n] = data[4:]
+
+        return bytes(out)
+
+    def read_ranges(self, ranges, block_size=None):
+        if self.cache and all(self.cache.covers(o, n) for o, n in ranges):
+            if not self.cache_checked:
+                self.check_cache(ranges)
+            need = self.cache.missing(ranges, self.cache_max_age)
+            for o, n in merge_ranges(need):
+                self.cache.put(o, self.read_range(o, n, block_size))
+            if need:
+                self.cache.save()
+            return [self.cache.get(o, n) for o, n in ranges]
+
+        chunks = [(o, self.read_range(o, n, block_size)) for o, n in merge_ranges(ranges)]
+        result = []
+        for offset, size in ranges:
+            for o, data in chunks:
+                if o <= offset and offset + size <= o + len(data):
+                    result.append(data[offset-o:offset-o+size])
+                    break
+        return result
+
+    def write_patch(self, progress=None):
+        from patch import PATCH
+        return self.upload(UVK5.CMD_PATCH_WRITE, bytes(PATCH), progress=progress or print_progress)
 
-        if preamble != UVK5.PREAMBLE:
-            raise ValueError('Bad response (PRE)', preamble)
+    def upload(self, cmd_id, data, chunk_sizes=UPLOAD_CHUNK_SIZES, window=UPLOAD_WINDOW, progress=None):
+        sizes = list(chunk_sizes)
+        size = sizes[0]
+        offset = 0
+        done = 0
+        chunks = []
+        pending = {}
+        failures = {}
+        confirmed = False
+        retries = self.retry.retries_for(cmd_id)
+        # rejected sizes are not answered, don't wait full timeout for them
+        self.timeout = UVK5.PROBE_TIMEOUT
+
+        while offset < len(data) or chunks or pending:
+            while (chunks or offset < len(data)) and len(pending) < window:
+                if chunks:
+                    o, n = chunks.pop(0)
+                else:
+                    o, n = offset, min(size, len(data) - offset)
+                    offset += n
+                self.write(self.codec.encode_write(cmd_id, o, data[o:o+n]))
+                pending[o & 0xFFFF] = (o, n, monotonic())
+
+            try:
+                res_id, res = self._read_response()
+            except CrcError:
+                # unknown chunk, the next ack or the timeout tells which one to resend
+                continue
+            except (ValueError, TimeoutError):
+                if not confirmed and len(sizes) > 1:
+                    sizes.pop(0)
+                    size = sizes[0]
+                    offset = 0
+                    chunks.clear()
+                else:
+                    # resend only chunks still in flight
+                    for o, n, _ in pending.values():
+                        failures[o] = failures.get(o, 0) + 1
+                        if failures[o] > retries:
+                            raise
+                    chunks = sorted((o, n) for o, n, _ in pending.values()) + chunks
+                pending.clear()
+                self.resync(max(failures.values(), default=1) - 1)
+                continue
 
-        payload_len = b2i(self.read(2)) + 2 # CRC len
-        payload = xor_comm(self.read(payload_len))
+            # late acks of resent chunks and unrelated frames are skipped
+            key = b2i(res[:2])
+            if res_id != cmd_id + 1 or key not in pending:
+                continue
 
-        # crc = payload[-2:]
-        postamble = self.read(2)
-        
-        if postamble != UVK5.POSTAMBLE:
-            raise ValueError('Bad response (POST)', postamble, payload, payload_len)
-            
-        # print(data.hex())
-        cmd_id = b2i(payload[:2])
-        data_len = b2i(payload[2:4])
-        data = payload[4:4+data_len]
+            # acks come in send order, chunks sent before this one lost their request or ack
+            lost = []
+            for k in list(pending):
+                if k == key:
+                    break
+                o, n, _ = pending.pop(k)
+                failures[o] = failures.get(o, 0) + 1
+                if failures[o] > retries:
+                    raise ValueError('Upload rejected at 0x%04x' % o, res_id, res)
+                lost.append((o, n))
+            chunks = lost + chunks
+            o, n, sent = pending.pop(key)
+
+            self.stats.record(cmd_id, monotonic() - sent)
+            if not confirmed:
+                confirmed = True
+                self.set_timeout_for(cmd_id)
+            done += n
+            if progress:
+                progress(done, len(data))
+
+        return size
 
-        return (cmd_id, data)
+    def cmd(self, id, body = b''):
+        return self.request(id, self._cmd_make_req(id, body))
 
     def cmdw(self, id, address,payload):
-        self.write(self._cmd_make_reqw(id, address, payload))
-        preamble = self.read(2)
-
-        if preamble != UVK5.PREAMBLE:
-            raise ValueError('Bad response (PRE)', preamble)
-
-        payload_len = b2i(self.read(2)) + 2 # CRC len
-        payload = xor_comm(self.read(payload_len))
-
-        # crc = payload[-2:]
-        postamble = self.read(2)
-        
-        if postamble != UVK5.POSTAMBLE:
-            raise ValueError('Bad response (POST)', postamble, payload, payload_len)
-            
-        # print(data.hex())
-        cmd_id = b2i(payload[:2])
-        data_len = b2i(payload[2:4])
-        data = payload[4:4+data_len]
-
-        return (cmd_id, data)
+        return self.request(id, self._cmd_make_reqw(id, address, payload))
+
+    def request(self, cmd_id, frame, retries=None):
+        if retries is None:
+            retries = self.retry.retries_for(cmd_id)
+        self.set_timeout_for(cmd_id)
+        for attempt in range(retries + 1):
+            try:
+                started = monotonic()
+                self.write(frame)
+                res = self._read_response()
+                self.stats.record(cmd_id, monotonic() - started)
+                return res
+            except (ValueError, TimeoutError) as e:
+                if isinstance(e, TimeoutError):
+                    self.stats.record_timeout(cmd_id)
+                if attempt == retries:
+                    raise
+                self.resync(attempt)
+
+    def set_timeout_for(self, cmd_id):
+        timeout = self.base_timeout
+        if self.adaptive_timeout:
+            timeout = self.stats.timeout_for(cmd_id, self.base_timeout)
+        if timeout != self.timeout:
+            self.timeout = timeout
+
+    def resync(self, attempt=0):
+        sleep(self.retry.delay(attempt))
+        self.reset_input_buffer()
+        self.decoder.reset()
+
+    def _read_response(self):
+        payload = self.read_frame()
+        check_crc(payload, self.retry.strict_crc)
+        return parse_payload(payload)
+
+    def read_frame(self):
+        deadline = monotonic() + self.timeout
+        payload = self.decoder.pop()
+        while payload is None:
+            if monotonic() > deadline:
+                raise TimeoutError(f'No response from {self.port}')
+            self.decoder.feed(self.read(self.in_waiting or 1))
+            payload = self.decoder.pop()
+        return payload
 
     def channels(self):
-        names = []
-        settings = []
-
-        data_size = 16 * 200
-        names_offset = 0x0F50
-        settings_offset = 0x0000
-
-        passes = data_size//UVK5.BLOCK_SIZE
-
-        out = StringIO()
-
-        for block in range(passes):
-            offset = names_offset + block*UVK5.BLOCK_SIZE
-            names_set = self.read_mem(offset, UVK5.BLOCK_SIZE)[1][4:]
-            names += [name.decode(errors='ignore').rstrip('\x00') for name in chunk(names_set, 16)]
-
-        for block in range(passes):
-            offset = settings_offset + block*UVK5.BLOCK_SIZE
-            settings_set = self.read_mem(offset, UVK5.BLOCK_SIZE)[1][4:]
-            settings += [(b2i(setting[:4])/100000.0, ) for setting in chunk(settings_set, 16)]
-        
-        for i, name in enumerate(names):
-            if name:
-                print(f'{i+1:0>3}. {name: <16} {settings[i][0]:0<8} M', file=out)
-            else:
-                print(f'{i+1:0>3}. -', file=out)
-
-        return out.getvalue()
+        return format_channels(*self.read_ranges(CHANNEL_RANGES))
 
     def read_eeprom(self, offset, size):
         size = int(size) if size else UVK5.BLOCK_SIZE
         data = self.read_mem(offset, size)
         print(data[1])
 
+    def write_mem(self, offset, data):
+        cmd_id, res = self.cmdw(UVK5.CMD_SETTINGS_WRITE_REQ, offset, data)
+        if cmd_id != UVK5.CMD_SETTINGS_WRITE_RES or b2i(res[:2]) != offset & 0xFFFF:
+            raise ValueError('Bad write response', cmd_id, res)
+        if self.cache and self.cache.covers(offset, len(data)):
+            self.cache.invalidate(offset, len(data))
+
+    def write_block_verified(self, offset, data):
+        self.write_mem(offset, data)
+        if self.read_range(offset, len(data)) != bytes(data):
+            raise ValueError('Verify failed at 0x%04x' % offset)
+        if self.cache and self.cache.covers(offset, len(data)):
+            self.cache.put(offset, data)
+            self.cache.save()
+
+    def dump_eeprom(self, path, offset=0, size=EEPROM_SIZE):
+        offset, size = int(offset), int(size)
+        path = Path(path)
+        part = path.with_name(path.name + '.part')
+        done = part.stat().st_size if part.exists() else 0
+        if not self.probed:
+            self.probe_block_size()
+        done -= done % self.block_size
+
+        with part.open('r+b' if done else 'wb') as f:
+            f.truncate(done)
+            f.seek(done)
+            step = self.block_size * UVK5.READ_WINDOW
+            for o in range(offset + done, offset + size, step):
+                f.write(self.read_range(o, min(step, offset + size - o)))
+                f.flush()
+                eprint(f'Dump 0x{o:04x} / 0x{offset + size:04x}', end='\r')
+
+        eprint()
+        part.replace(path)
+
+    def restore_eeprom(self, path, offset=0, calibration=False):
+        offset = int(offset)
+        path = Path(path)
+        image = path.read_bytes()
+        end = offset + len(image)
+        # from the command line this is a string, '0' must not unlock calibration
+        if calibration not in (True, '1', 'yes'):
+            end = min(end, UVK5.CALIBRATION_START)
+
+        progress = path.with_name(path.name + '.restore')
+        start = int(progress.read_text()) if progress.exists() else offset
+
+        for o in range(start, end, UVK5.BLOCK_SIZE):
+            block = image[o-offset:min(o + UVK5.BLOCK_SIZE, end)-offset]
+            self.write_block_verified(o, block)
+            progress.write_text(str(o + len(block)))
+            eprint(f'Restore 0x{o:04x} / 0x{end:04x}', end='\r')
+
+        eprint()
+        progress.unlink(missing_ok=True)
+
+    def write_eeprom(self, path, base=None, offset=0, calibration=False):
+        offset = int(offset)
+        image = Path(path).read_bytes()
+        end = offset + len(image)
+        if calibration not in (True, '1', 'yes'):
+            end = min(end, UVK5.CALIBRATION_START)
+        image = image[:end-offset]
+
+        if base:
+            current = Path(base).read_bytes()[:len(image)]
+        else:
+            current = self.read_range(offset, len(image))
 
-    def _cmd_make_req(self, cmd_id, body=b''):
-        data = body + self.timestamp
-        payload = i2b16(cmd_id) + len16(data) + data
-        encoded_payload = xor_comm(payload + crc16(payload))
+        blocks = changed_blocks(image, current, offset, UVK5.BLOCK_SIZE)
+        for o in blocks:
+            start, stop = max(o, offset), min(o + UVK5.BLOCK_SIZE, end)
+            self.write_block_verified(start, image[start-offset:stop-offset])
+            eprint(f'Write 0x{start:04x}')
 
-        return UVK5.PREAMBLE + len16(payload) + encoded_payload + UVK5.POSTAMBLE
+        return f'{len(blocks)} blocks changed'
 
-    def _cmd_make_reqw(self, cmd_id, address, payload):
-        payload = i2b16(cmd_id) + struct.pack('<HHH',len(payload)+8, address, len(payload)) + self.timestamp + payload
-        encoded_payload = xor_comm(payload + crc16(payload))
 
-        return UVK5.PREAMBLE + len16(payload) + encoded_payload + UVK5.POSTAMBLE
-        
+    def _cmd_make_req(self, cmd_id, body=b''):
+        return self.codec.encode(cmd_id, body)
+
+    def _cmd_make_reqw(self, cmd_id, address, payload):
+        return self.codec.encode_write(cmd_id, address, payload)
 
 
 if __name__ == '__main__':
     if len(argv) < 3:
-        eprint(f'Usage: {argv[0]} <port> <command:(channels|version)> [args]')
+        eprint(f'Usage: {argv[0]} <port> <command:(channels|version|dump_eeprom|restore_eeprom|write_eeprom)> [args] [--cache[=max_age]] [--stats]')
         exit(255)
 
     port = argv[1]
     cmd = argv[2]
-    args = argv[3:]
+    flags = dict(a[2:].partition('=')[::2] for a in argv[3:] if a.startswith('--'))
+    args = [a for a in argv[3:] if not a.startswith('--')]
     for i in range(len(args)):
         if args[i][:2] == '0x':
             args[i] = int(args[i][2:], 16)
 
     with UVK5(port) as s:
-        version = s.get_version()
-        if cmd == 'version':
-            print('FW Version:', version)
-            exit(0)
-
-        res = getattr(s, cmd)(*args)
-        if res:
-            print(res)
-
+        try:
+            version = s.get_version()
+            if cmd == 'version':
+                print('FW Version:', version)
+                exit(0)
+
+            if 'cache' in flags:
+                s.use_cache(float(flags['cache']) if flags['cache'] else None)
+
+            res = getattr(s, cmd)(*args)
+            if res:
+                print(res)
+        finally:
+            if 'stats' in flags:
+                eprint(s.stats.report(), end='')
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import asyncio
+from sys import argv
+from time import time
+
+from serial import Serial
+
+from uvk5 import (
+    UVK5, CHANNEL_RANGES, CrcError, FrameCodec, FrameDecoder, RetryPolicy, b2i,
+    check_crc, chunk, eprint, format_channels, i2b16, i2b32, merge_ranges,
+    parse_payload,
+)
+
+
+class AsyncUVK5:
+    def __init__(self, port, timeout=5) -> None:
+        self.port = port
+        self.timeout = timeout
+        self.timestamp = i2b32(time())
+        self.codec = FrameCodec(self.timestamp)
+        self.block_size = UVK5.BLOCK_SIZE
+        self.version = None
+        self.serial = None
+        self.decoder = FrameDecoder()
+        self.retry = RetryPolicy()
+        self.frames = asyncio.Queue()
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def open(self):
+        self.serial = Serial(self.port, 38400, timeout=0)
+        asyncio.get_running_loop().add_reader(self.serial.fileno(), self._on_readable)
+
+    async def close(self):
+        if self.serial:
+            asyncio.get_running_loop().remove_reader(self.serial.fileno())
+            self.serial.close()
+            self.serial = None
+
+    def _on_readable(self):
+        self.decoder.feed(self.serial.read(self.serial.in_waiting or 1))
+        while (payload := self.decoder.pop()) is not None:
+            try:
+                check_crc(payload, self.retry.strict_crc)
+            except CrcError as e:
+                self.frames.put_nowait(e)
+                continue
+            self.frames.put_nowait(parse_payload(payload))
+
+    async def _request(self, encode, id, *args):
+        retries = self.retry.retries_for(id)
+        async with self.lock:
+            # codec output is a view into its shared buffer, encode only while holding the lock
+            frame = bytes(encode(id, *args))
+            for attempt in range(retries + 1):
+                while not self.frames.empty():
+                    self.frames.get_nowait()
+                self.serial.write(frame)
+                try:
+                    res = await asyncio.wait_for(self.frames.get(), self.timeout)
+                    if isinstance(res, CrcError):
+                        raise res
+                    return res
+                except (CrcError, TimeoutError):
+                    if attempt == retries:
+                        raise
+                    await asyncio.sleep(self.retry.delay(attempt))
+
+    async def cmd(self, id, body=b''):
+        return await self._request(self.codec.encode, id, body)
+
+    async def cmdw(self, id, address, payload):
+        return await self._request(self.codec.encode_write, id, address, payload)
+
+    async def get_version(self):
+        self.version = (await self.cmd(UVK5.CMD_VERSION_REQ))[1][:10].decode().rstrip('\x00')
+        return self.version
+
+    async def read_mem(self, offset, size):
+        return await self.cmd(UVK5.CMD_SETTINGS_REQ, i2b32(offset) + i2b16(size))
+
+    async def read_range(self, offset, size):
+        out = bytearray()
+        for o in range(offset, offset + size, self.block_size):
+            n = min(self.block_size, offset + size - o)
+            cmd_id, data = await self.read_mem(o, n)
+            if cmd_id != UVK5.CMD_SETTINGS_RES or b2i(data[:2]) != o & 0xFFFF or len(data) != n + 4:
+                raise ValueError('Bad read response', cmd_id, data[:4])
+            out += data[4:]
+        return bytes(out)
+
+    async def read_ranges(self, ranges):
+        chunks = [(o, await self.read_range(o, n)) for o, n in merge_ranges(ranges)]
+        result = []
+        for offset, size in ranges:
+            for o, data in chunks:
+                if o <= offset and offset + size <= o + len(data):
+                    result.append(data[offset-o:offset-o+size])
+                    break
+        return result
+
+    async def channels(self):
+        return format_channels(*await self.read_ranges(CHANNEL_RANGES))
+
+    async def write_mem(self, offset, data):
+        cmd_id, res = await self.cmdw(UVK5.CMD_SETTINGS_WRITE_REQ, offset, data)
+        if cmd_id != UVK5.CMD_SETTINGS_WRITE_RES or b2i(res[:2]) != offset & 0xFFFF:
+            raise ValueError('Bad write response', cmd_id, res)
+
+    async def write_range(self, offset, data):
+        for i, block in enumerate(chunk(data, UVK5.BLOCK_SIZE)):
+            await self.write_mem(offset + i * UVK5.BLOCK_SIZE, block)
+
+
+async def run(port, cmd):
+    async with AsyncUVK5(port) as radio:
+        version = await radio.get_version()
+        if cmd == 'version':
+            return f'FW Version: {version}'
+        return await getattr(radio, cmd)()
+
+
+async def main(ports, cmd):
+    results = await asyncio.gather(*(run(p, cmd) for p in ports), return_exceptions=True)
+    for port, res in zip(ports, results):
+        print(f'== {port}')
+        print(res)
+
+
+if __name__ == '__main__':
+    if len(argv) < 3:
+        eprint(f'Usage: {argv[0]} <command:(channels|version)> <port> [port...]')
+        exit(255)
+
+    asyncio.run(main(argv[2:], argv[1]))